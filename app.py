@@ -1,8 +1,11 @@
+import hashlib
+import numpy as np
 import pandas as pd
 import streamlit as st
+import xlsxwriter
 from rapidfuzz import process, fuzz
-from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
+from pathlib import Path
 import requests
 
 # ────────────────────────────────────────────────────────────────
@@ -11,6 +14,16 @@ import requests
 PRODUCT_INFO_URL = (
     "https://raw.githubusercontent.com/zhengtaijun/JHCH_TRF-Volume/main/product_info.xlsx"
 )
+PRODUCT_INFO_CACHE = Path.home() / ".cache" / "trf_volume" / "product_info.parquet"
+# cdist runs in rapidfuzz's C++ thread pool without the GIL; -1 = all cores.
+MATCH_WORKERS = -1
+# partial_ratio finds a catalogue name inside a longer warehouse description;
+# scores below the cutoff come back as 0 so rapidfuzz can exit early.
+MATCH_SCORER = fuzz.partial_ratio
+MATCH_SCORE_CUTOFF = 80
+# float32 would print as e.g. 0.8989989757537842 instead of 0.898999 in the
+# exported workbook, so volumes and quantities stay float64.
+VOLUME_DTYPE = np.float64
 
 st.set_page_config(page_title="TRF Volume Calculator By Andy Wang", layout="centered")
 st.title("📦 Jory Henley CHC TRF Volume Calculator")
@@ -35,85 +48,186 @@ col_quantity = st.number_input(
     "Column number of *Quantity*", min_value=1, value=8
 )
 
+st.sidebar.checkbox("Show debug output", key="debug")
+
+
+def debug(*args):
+    """st.write, but only when the sidebar debug toggle is on."""
+    if st.session_state.get("debug"):
+        st.write(*args)
+
+
 # ────────────────────────────────────────────────────────────────
 # LOAD PRODUCT INFO FROM GITHUB
 # ────────────────────────────────────────────────────────────────
-@st.cache_data
-def load_product_info():
-    response = requests.get(PRODUCT_INFO_URL)
-    response.raise_for_status()
+@st.cache_resource(max_entries=1)
+def fuzzy_match_cache(catalog_version: str) -> dict[str, float]:
+    """Fuzzy-match results by product name for one catalog version."""
+    return {}
 
-    df = pd.read_excel(BytesIO(response.content))
-    st.write("✅ Product-info file loaded. Columns found:", df.columns.tolist())
 
+def read_product_info() -> tuple[pd.DataFrame, str]:
+    """Product Name/CBM table plus its version (ETag, or a content hash)."""
+    etag_file = PRODUCT_INFO_CACHE.with_suffix(".etag")
+    headers = {}
+    if PRODUCT_INFO_CACHE.exists() and etag_file.exists():
+        headers["If-None-Match"] = etag_file.read_text()
+
+    response = requests.get(PRODUCT_INFO_URL, headers=headers)
+    if response.status_code == 304:
+        df = pd.read_parquet(PRODUCT_INFO_CACHE, columns=["Product Name", "CBM"])
+        return df, headers["If-None-Match"]
+    response.raise_for_status()
+
+    df = pd.read_excel(
+        BytesIO(response.content),
+        engine="calamine",
+        usecols=lambda c: c in {"Product Name", "CBM"},
+        dtype={"Product Name": "string"},
+    )
     if {"Product Name", "CBM"} - set(df.columns):
         raise ValueError("The Excel file must contain 'Product Name' and 'CBM' columns")
+    df["CBM"] = pd.to_numeric(df["CBM"], errors="coerce")
+
+    PRODUCT_INFO_CACHE.parent.mkdir(parents=True, exist_ok=True)
+    df.to_parquet(PRODUCT_INFO_CACHE, index=False)
+    if etag := response.headers.get("ETag"):
+        etag_file.write_text(etag)
+    else:
+        etag_file.unlink(missing_ok=True)
+    return df, etag or hashlib.sha1(response.content).hexdigest()
+
+
+@st.cache_data(ttl=3600)
+def load_product_info():
+    df, catalog_version = read_product_info()
+
+    names = df["Product Name"].fillna("")
+    cbms = df["CBM"].fillna(0).to_numpy()
 
-    names = df["Product Name"].fillna("").astype(str)
-    cbms = pd.to_numeric(df["CBM"], errors="coerce").fillna(0)
+    product_dict = dict(zip(names.to_numpy(), cbms))
 
-    product_dict = dict(zip(names.tolist(), cbms.tolist()))
-    return product_dict, names.tolist()
+    # Case/whitespace-insensitive view for the second exact pass and fuzzing.
+    norm_dict = dict(zip(names.str.strip().str.lower().to_numpy(), cbms))
+    norm_dict.pop("", None)
+    product_name_list = list(norm_dict)
 
+    return product_dict, norm_dict, product_name_list, catalog_version
 
-product_dict, product_name_list = load_product_info()
+
+product_dict, norm_dict, product_name_list, catalog_version = load_product_info()
+debug("✅ Product-info file loaded. Products found:", len(product_dict))
 
 # ────────────────────────────────────────────────────────────────
 # MATCHING FUNCTION
 # ────────────────────────────────────────────────────────────────
-def match_product(name: str):
-    """Exact match first, then fuzzy match (partial_ratio ≥ 80)."""
-    if name in product_dict:
-        return product_dict[name]
-    match, score, _ = process.extractOne(
-        name, product_name_list, scorer=fuzz.partial_ratio
+def fuzzy_match(queries: list[str]) -> list[float]:
+    """Fuzzy-score every query against the whole catalog; NaN means no match."""
+    if not product_name_list:
+        return [np.nan] * len(queries)
+
+    scores = process.cdist(
+        [q.lower() for q in queries],
+        product_name_list,
+        scorer=MATCH_SCORER,
+        score_cutoff=MATCH_SCORE_CUTOFF,
+        dtype=np.uint8,
+        workers=MATCH_WORKERS,
     )
-    return product_dict[match] if score >= 80 else None
+    best = scores.argmax(axis=1)
+    best_score = scores.max(axis=1)
+    return [
+        norm_dict[product_name_list[i]] if score else np.nan
+        for i, score in zip(best, best_score)
+    ]
+
+
+def match_products(names: pd.Series) -> pd.Series:
+    """Exact match, then case-insensitive match, then one batched fuzzy pass."""
+    volumes = names.map(product_dict)
+    mask = volumes.isna() & (names != "")
+    if not mask.any():
+        return volumes
+
+    volumes.loc[mask] = names[mask].str.lower().map(norm_dict)
+    mask &= volumes.isna()
+    if not mask.any():
+        return volumes
+
+    cache = fuzzy_match_cache(catalog_version)
+    pending = dict.fromkeys(names[mask].to_numpy())
+    unknown = [n for n in pending if n not in cache]
+    if unknown:
+        cache.update(zip(unknown, fuzzy_match(unknown)))
+
+    fuzzy_dict = {n: cache[n] for n in pending}
+    volumes.loc[mask] = names[mask].map(fuzzy_dict).astype(VOLUME_DTYPE)
+    return volumes
 
 
 # ────────────────────────────────────────────────────────────────
 # MAIN PROCESSING FUNCTION
 # ────────────────────────────────────────────────────────────────
 def process_warehouse_file(file, p_col, q_col):
-    df = pd.read_excel(file)
-    st.write("📊 Warehouse file loaded. Shape:", df.shape)
+    df = pd.read_excel(file, engine="calamine")
+    debug("📊 Warehouse file loaded. Shape:", df.shape)
 
-    product_names = df.iloc[:, p_col].fillna("").astype(str).tolist()
-    quantities = pd.to_numeric(df.iloc[:, q_col], errors="coerce").fillna(0)
+    names_col = df.iloc[:, p_col].fillna("")
+    if not pd.api.types.is_string_dtype(names_col):
+        names_col = names_col.astype(str)
+    product_names = names_col.str.strip()
+    qty_arr = (
+        pd.to_numeric(df.iloc[:, q_col], errors="coerce")
+        .fillna(0)
+        .to_numpy(dtype=VOLUME_DTYPE)
+    )
+
+    debug("🧾 Sample product names:", product_names.head().tolist())
+    debug("🔢 Sample quantities:", qty_arr[:5].tolist())
 
-    st.write("🧾 Sample product names:", product_names[:5])
-    st.write("🔢 Sample quantities:", quantities.head().tolist())
+    volumes = match_products(product_names)
 
-    total = len(product_names)
-    volumes: list[float | None] = []
+    debug("🧮 Volume matching done. First 10:", volumes.head(10).tolist())
 
-    def worker(start: int, end: int):
-        partial = []
-        for i in range(start, end):
-            name = product_names[i].strip()
-            vol = match_product(name) if name else None
-            partial.append(vol)
-        return partial
+    vol_arr = volumes.to_numpy(dtype=VOLUME_DTYPE, na_value=0.0)
+    df["Volume"] = vol_arr
+    total_arr = vol_arr * qty_arr
+    df["Total Volume"] = total_arr
+    debug("✅ Columns ‘Volume’ and ‘Total Volume’ added")
 
-    with ThreadPoolExecutor(max_workers=4) as pool:
-        step = max(total // 4, 1)
-        futures = []
-        for i in range(4):
-            s = i * step
-            e = (i + 1) * step if i < 3 else total
-            futures.append(pool.submit(worker, s, e))
-        for f in futures:
-            volumes.extend(f.result())
+    return df, float(total_arr.sum())
 
-    st.write("🧮 Volume matching done. First 10:", volumes[:10])
 
-    df["Volume"] = pd.to_numeric(pd.Series(volumes), errors="coerce").fillna(0)
-    df["Total Volume"] = df["Volume"] * quantities
-    st.write("✅ Columns ‘Volume’ and ‘Total Volume’ added")
+# ────────────────────────────────────────────────────────────────
+# EXCEL EXPORT
+# ────────────────────────────────────────────────────────────────
+def build_result_workbook(df: pd.DataFrame, total_volume: float) -> BytesIO:
+    """Stream df to xlsx row by row, with the grand total under Total Volume."""
+    output = BytesIO()
+    # constant_memory flushes each row as soon as the next one starts, so
+    # cells must be written strictly in row order.
+    workbook = xlsxwriter.Workbook(
+        output,
+        {
+            "constant_memory": True,
+            "default_date_format": "yyyy-mm-dd hh:mm:ss",
+            "remove_timezone": True,
+        },
+    )
+    sheet = workbook.add_worksheet("Sheet1")
+    header = workbook.add_format(
+        {"bold": True, "border": 1, "align": "center", "valign": "top"}
+    )
+
+    sheet.write_row(0, 0, df.columns.tolist(), header)
+    values = df.astype(object).where(df.notna(), None)
+    for row, record in enumerate(values.itertuples(index=False, name=None), 1):
+        sheet.write_row(row, 0, record)
+    sheet.write(len(df) + 1, df.columns.get_loc("Total Volume"), total_volume)
 
-    total_row = pd.DataFrame({"Total Volume": [df["Total Volume"].sum()]})
-    df = pd.concat([df, total_row], ignore_index=True)
-    return df
+    workbook.close()
+    output.seek(0)
+    return output
 
 
 # ────────────────────────────────────────────────────────────────
@@ -122,15 +236,12 @@ def process_warehouse_file(file, p_col, q_col):
 if warehouse_file and st.button("📐 Calculate"):
     with st.spinner("Processing…"):
         try:
-            result_df = process_warehouse_file(
+            result_df, total_volume = process_warehouse_file(
                 warehouse_file, col_product - 1, col_quantity - 1
             )
 
             st.success("✅ Calculation complete! Download below:")
-            output = BytesIO()
-            with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
-                result_df.to_excel(writer, index=False)
-            output.seek(0)
+            output = build_result_workbook(result_df, total_volume)
 
             st.download_button(
                 "📥 Download Excel",
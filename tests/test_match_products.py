@@ -0,0 +1,71 @@
+import importlib.util
+from io import BytesIO
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+import requests
+
+ROOT = Path(__file__).resolve().parents[1]
+
+
+class _Response:
+    status_code = 200
+    headers = {"ETag": '"test"'}
+    content = (ROOT / "product_info.xlsx").read_bytes()
+
+    def raise_for_status(self):
+        pass
+
+
+@pytest.fixture(scope="module")
+def app(tmp_path_factory):
+    """app.py loaded against the bundled product_info.xlsx, without network."""
+    mp = pytest.MonkeyPatch()
+    mp.setenv("HOME", str(tmp_path_factory.mktemp("home")))
+    mp.setattr(requests, "get", lambda *args, **kwargs: _Response())
+    spec = importlib.util.spec_from_file_location("app", ROOT / "app.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    yield module
+    mp.undo()
+
+
+@pytest.fixture(scope="module")
+def known_product(app):
+    return next(name for name, cbm in app.product_dict.items() if cbm > 0)
+
+
+def test_unmatched_fuzzy_name_stays_numeric(app, known_product):
+    names = pd.Series([known_product, "qqqq zzzz"])
+
+    # Second call hits the cached miss for "qqqq zzzz".
+    for _ in range(2):
+        volumes = app.match_products(names)
+        assert volumes.dtype == np.float64
+        assert volumes[0] == app.product_dict[known_product]
+        assert np.isnan(volumes[1])
+
+
+def test_empty_catalog_returns_nan(app, monkeypatch):
+    monkeypatch.setattr(app, "product_name_list", [])
+    assert np.isnan(app.fuzzy_match(["anything"])).all()
+
+
+def test_upload_with_unmatched_product(app, known_product):
+    upload = BytesIO()
+    pd.DataFrame(
+        {
+            "Product": [known_product, known_product.upper(), "qqqq zzzz"],
+            "Qty": [2, 1, 5],
+        }
+    ).to_excel(upload, index=False)
+    upload.seek(0)
+
+    df, total = app.process_warehouse_file(upload, 0, 1)
+
+    cbm = app.product_dict[known_product]
+    assert df["Volume"].tolist() == [cbm, cbm, 0.0]
+    assert df["Total Volume"].tolist() == [2 * cbm, cbm, 0.0]
+    assert total == pytest.approx(3 * cbm)